@@ -0,0 +1,12 @@
+# Production entrypoint: gunicorn app:app -c gunicorn.conf.py
+import multiprocessing
+import os
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+# One asyncio loop per process; multiple processes sidestep the GIL for parsing/rendering
+workers = int(os.getenv("WEB_CONCURRENCY", 2 * multiprocessing.cpu_count() + 1))
+# uvicorn.workers is deprecated; the worker now lives in the uvicorn-worker package
+worker_class = "uvicorn_worker.UvicornWorker"
+# Import the app (LLM clients, prompt, compiled templates) once in the master and
+# fork workers from it, sharing those read-only pages copy-on-write
+preload_app = True
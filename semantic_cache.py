@@ -0,0 +1,90 @@
+import asyncio
+import json
+import os
+
+import faiss
+import numpy as np
+from langchain_google_genai import GoogleGenerativeAIEmbeddings
+
+
+class SemanticCache:
+    """
+    Embedding cache that returns stored feedback for near-duplicate submissions.
+    Vectors are L2-normalized so inner product equals cosine similarity.
+    The FAISS index and its feedback JSON are persisted side by side on disk,
+    at most once per save_interval seconds and off the event loop.
+    Each worker keeps its own copy in memory; on disk the last writer wins.
+    """
+
+    def __init__(self, index_path: str, threshold: float = 0.93,
+                 model: str = "models/text-embedding-004", max_entries: int = 10_000,
+                 save_interval: float = 30.0):
+        self.embeddings = GoogleGenerativeAIEmbeddings(model=model)
+        self.index_path = index_path
+        self.entries_path = index_path + ".json"
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.save_interval = save_interval
+        self.index = None
+        self.entries: list[str] = []
+        self._dirty = False
+        self._save_task: asyncio.Task | None = None
+
+        if os.path.exists(self.index_path) and os.path.exists(self.entries_path):
+            index = faiss.read_index(self.index_path)
+            with open(self.entries_path) as f:
+                entries = json.load(f)
+            # Files from two different saves do not line up: start empty instead
+            if index.ntotal == len(entries):
+                self.index, self.entries = index, entries
+
+    async def embed(self, text: str) -> np.ndarray:
+        """Embed text as a normalized 1 x dim float32 matrix."""
+        vector = np.asarray([await self.embeddings.aembed_query(text)], dtype="float32")
+        faiss.normalize_L2(vector)
+        return vector
+
+    def lookup(self, vector: np.ndarray) -> str | None:
+        """Return the cached feedback JSON of the nearest entry above threshold."""
+        if self.index is None or self.index.ntotal == 0:
+            return None
+        scores, ids = self.index.search(vector, 1)
+        if 0 <= ids[0][0] < len(self.entries) and scores[0][0] >= self.threshold:
+            return self.entries[ids[0][0]]
+        return None
+
+    def add(self, vector: np.ndarray, feedback_json: str) -> None:
+        """Index a new vector with its feedback JSON and schedule a save."""
+        if len(self.entries) >= self.max_entries:
+            return
+        if self.index is None:
+            self.index = faiss.IndexFlatIP(vector.shape[1])
+        self.index.add(vector)
+        self.entries.append(feedback_json)
+        self._dirty = True
+        if self._save_task is None or self._save_task.done():
+            self._save_task = asyncio.get_running_loop().create_task(self._save_later())
+
+    async def _save_later(self) -> None:
+        await asyncio.sleep(self.save_interval)
+        await self.flush()
+
+    async def flush(self) -> None:
+        """Write pending additions to disk in a worker thread."""
+        if not self._dirty:
+            return
+        self._dirty = False
+        # Snapshot on the loop so the thread never sees a half-applied add()
+        index_bytes = faiss.serialize_index(self.index)
+        entries = list(self.entries)
+        await asyncio.to_thread(self._write, index_bytes, entries)
+
+    def _write(self, index_bytes: np.ndarray, entries: list[str]) -> None:
+        # Write to per-process temp files, then rename over the originals so
+        # readers never see a partially written file
+        suffix = f".{os.getpid()}.tmp"
+        index_bytes.tofile(self.index_path + suffix)
+        with open(self.entries_path + suffix, "w") as f:
+            json.dump(entries, f)
+        os.replace(self.index_path + suffix, self.index_path)
+        os.replace(self.entries_path + suffix, self.entries_path)
@@ -4,7 +4,6 @@ from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import PydanticOutputParser
 import json
-import re
 
 load_dotenv()
 
@@ -52,27 +51,75 @@ ALWAYS respond with VALID JSON only. Do NOT include explanations, markdown fence
 ]).partial(format_instructions=parser.get_format_instructions())
 
 # === Helper functions ===
+# (field, alternate key the model sometimes emits, default), walked once per reply
+_FIELD_ALIASES = (
+    ("topic", None, "Unknown Topic"),
+    ("numerical_grade", "overall_score", 0),
+    ("letter_grade", None, "A+"),
+    ("score_content", "content_score", 0),
+    ("score_organization", "organization_score", 0),
+    ("score_mechanics", "mechanics_score", 0),
+    ("calculation", "score_breakdown", ""),
+    ("strengths", None, []),
+    ("weaknesses", None, []),
+    ("improvement_suggestions", None, []),
+    ("mechanics_issues", None, []),
+)
+
 def adapt_feedback(raw_dict):
     """Map model output to LessonFeedback schema, with defaults."""
-    return {
-        "topic": raw_dict.get("topic", "Unknown Topic"),
-        "numerical_grade": raw_dict.get("numerical_grade") or raw_dict.get("overall_score", 0),
-        "letter_grade": raw_dict.get("letter_grade", "A+"),
-        "score_content": raw_dict.get("score_content") or raw_dict.get("content_score", 0),
-        "score_organization": raw_dict.get("score_organization") or raw_dict.get("organization_score", 0),
-        "score_mechanics": raw_dict.get("score_mechanics") or raw_dict.get("mechanics_score", 0),
-        "calculation": raw_dict.get("calculation") or raw_dict.get("score_breakdown", ""),
-        "strengths": raw_dict.get("strengths", []),
-        "weaknesses": raw_dict.get("weaknesses", []),
-        "improvement_suggestions": raw_dict.get("improvement_suggestions", []),
-        "mechanics_issues": raw_dict.get("mechanics_issues", []),
-    }
+    adapted = {}
+    for field, alias, default in _FIELD_ALIASES:
+        if alias is None:
+            adapted[field] = raw_dict.get(field, default)
+            continue
+        value = raw_dict.get(field)
+        if not value:
+            value = raw_dict.get(alias, default)
+        adapted[field] = value
+    return adapted
 
 def extract_json(text: str) -> str:
     """Extract JSON object from raw text (handles fences or extra text)."""
-    text = text.strip()
-    match = re.search(r"\{.*\}", text, re.DOTALL)
-    return match.group(0) if match else "{}"
+    start = text.find("{")
+    if start < 0:
+        return "{}"
+    # Single linear scan tracking brace depth; braces inside strings are ignored
+    depth, in_str, esc = 0, False, False
+    for i in range(start, len(text)):
+        c = text[i]
+        if in_str:
+            if esc:
+                esc = False
+            elif c == "\\":
+                esc = True
+            elif c == '"':
+                in_str = False
+        elif c == '"':
+            in_str = True
+        elif c == "{":
+            depth += 1
+        elif c == "}":
+            depth -= 1
+            if depth == 0:
+                return text[start:i + 1]
+    return "{}"
+
+def parse_reply(raw_text: str) -> dict:
+    """Extract and parse the JSON object in a raw LLM reply ({} if malformed)."""
+    # Fast path: the model followed the "VALID JSON only" instruction
+    text = raw_text.strip()
+    if text.startswith("{") and text.endswith("}"):
+        try:
+            raw_dict = json.loads(text)
+            return raw_dict if isinstance(raw_dict, dict) else {}
+        except json.JSONDecodeError:
+            pass  # e.g. '{"a":1} trailing {"b":2}': fall back to the scan
+    try:
+        raw_dict = json.loads(extract_json(text))
+    except json.JSONDecodeError:
+        raw_dict = {}
+    return raw_dict if isinstance(raw_dict, dict) else {}
 
 # === New function: get AI-generated perfect explanation ===
 def perfect_example_for_topic(topic: str, reference_text: str):
@@ -95,11 +142,7 @@ def perfect_example_for_topic(topic: str, reference_text: str):
     raw_text = getattr(raw_response, "content", raw_response)
 
     # --- Extract JSON from raw response ---
-    json_text = extract_json(raw_text)
-    try:
-        raw_dict = json.loads(json_text)
-    except json.JSONDecodeError:
-        raw_dict = {}
+    raw_dict = parse_reply(raw_text)
 
     adapted_dict = adapt_feedback(raw_dict)
     feedback = LessonFeedback(**adapted_dict)